@@ -5,31 +5,42 @@ import re
 import google.generativeai as genai
 from dotenv import load_dotenv
 import uuid
+import hashlib
 import requests
 
-class EthnicityDetectionAgent:
-    """An agent that detects the ethnicity of a given name using the Gemini API."""
+from .hedging import HedgedCaller
 
-    def __init__(self):
-        load_dotenv()
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY not found in .env file.")
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-pro-latest')
-        self.generation_config = genai.types.GenerationConfig(temperature=0.0)
 
-    def run(self, name: str) -> Dict[str, Any]:
-        """
-        Runs the ethnicity detection process.
+def config_fingerprint(*parts: Any) -> str:
+    """Returns a short, stable hash of the configuration that produces an agent's output."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
 
-        Args:
-            name: The romanized name to analyze.
 
-        Returns:
-            A dictionary with the predicted ethnicity and confidence.
-        """
-        prompt = f"""
+def _query_gemini(model, generation_config, prompt: str, timeout: float) -> Dict[str, Any]:
+    """Calls Gemini and parses its JSON answer, raising if the response is unusable."""
+    response = model.generate_content(
+        prompt,
+        generation_config=generation_config,
+        # Bounds each attempt, so a hedged call that lost does not hold a worker for long.
+        request_options={"timeout": timeout}
+    )
+    # Clean up the response to extract only the JSON part
+    json_str = re.search(r'```json\n({.*?})\n```', response.text, re.DOTALL)
+    if json_str:
+        return json.loads(json_str.group(1))
+    else:
+        # Fallback for when the model doesn't use markdown
+        return json.loads(response.text)
+
+
+class EthnicityDetectionAgent:
+    """An agent that detects the ethnicity of a given name using the Gemini API."""
+
+    MODEL_NAME = 'gemini-1.5-pro-latest'
+    TEMPERATURE = 0.0
+
+    PROMPT_TEMPLATE = """
         Analyze the following name and determine its most likely ethnic origin.
 
         **IMPORTANT**: Please prioritize the following ethnicities if they are a plausible match: **Vietnamese, Chinese, Arabic, Indian**.
@@ -54,49 +65,55 @@ class EthnicityDetectionAgent:
         JSON response:
         """
 
+    def __init__(self):
+        load_dotenv()
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY not found in .env file.")
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(self.MODEL_NAME)
+        self.generation_config = genai.types.GenerationConfig(temperature=self.TEMPERATURE)
+        self.hedger = HedgedCaller.from_env("ethnicity")
+
+    def config_fingerprint(self) -> str:
+        """Fingerprint of the model and prompt; cached results with another fingerprint are stale."""
+        return config_fingerprint(self.MODEL_NAME, self.TEMPERATURE, self.PROMPT_TEMPLATE)
+
+    def run(self, name: str) -> Dict[str, Any]:
+        """
+        Runs the ethnicity detection process.
+
+        Args:
+            name: The romanized name to analyze.
+
+        Returns:
+            A dictionary with the predicted ethnicity and confidence.
+        """
+        prompt = self.PROMPT_TEMPLATE.format(name=name)
+
         try:
-            response = self.model.generate_content(
-                prompt,
-                generation_config=self.generation_config
+            # Temperature is 0.0, so a hedged duplicate request is safe.
+            return self.hedger.call(
+                lambda: _query_gemini(self.model, self.generation_config, prompt, self.hedger.attempt_timeout)
             )
-            # Clean up the response to extract only the JSON part
-            json_str = re.search(r'```json\n({.*?})\n```', response.text, re.DOTALL)
-            if json_str:
-                return json.loads(json_str.group(1))
-            else:
-                # Fallback for when the model doesn't use markdown
-                return json.loads(response.text)
         except (Exception, json.JSONDecodeError) as e:
             print(f"Error processing Gemini response: {e}")
             return {
                 "ethnicity": "Error",
                 "confidence": 0.0,
                 "alternatives": [],
-                "details": "Failed to parse response from the AI model."
+                "details": "Failed to parse response from the AI model.",
+                "error": True
             }
 
 
 class NameTransliterationAgent:
     """An agent that converts a romanized name to its native script."""
 
-    def __init__(self):
-        # The API key setup is lightweight, so it's safe to run it again.
-        load_dotenv()
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY not found for Transliteration Agent.")
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-pro-latest')
-        self.generation_config = genai.types.GenerationConfig(temperature=0.0)
+    MODEL_NAME = 'gemini-1.5-pro-latest'
+    TEMPERATURE = 0.0
 
-    def run(self, name: str, ethnicity: str) -> Dict[str, str]:
-        """
-        Converts the name to its native script based on ethnicity.
-        """
-        if ethnicity in ["Error", "Uncertain (Agent)"]:
-             return {"native_script": name, "transliteration_successful": False, "details": "Cannot transliterate without a clear ethnicity."}
-
-        prompt = f"""
+    PROMPT_TEMPLATE = """
         Analyze the following romanized name and its ethnicity. Your task is to convert the name into its native script.
 
         **Crucial Instructions:**
@@ -122,27 +139,51 @@ class NameTransliterationAgent:
 
         JSON response:
         """
+
+    def __init__(self):
+        # The API key setup is lightweight, so it's safe to run it again.
+        load_dotenv()
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY not found for Transliteration Agent.")
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(self.MODEL_NAME)
+        self.generation_config = genai.types.GenerationConfig(temperature=self.TEMPERATURE)
+        self.hedger = HedgedCaller.from_env("transliteration")
+
+    def config_fingerprint(self) -> str:
+        """Fingerprint of the model and prompt; cached results with another fingerprint are stale."""
+        return config_fingerprint(self.MODEL_NAME, self.TEMPERATURE, self.PROMPT_TEMPLATE)
+
+    def run(self, name: str, ethnicity: str) -> Dict[str, str]:
+        """
+        Converts the name to its native script based on ethnicity.
+        """
+        if ethnicity in ["Error", "Uncertain (Agent)"]:
+             return {"native_script": name, "transliteration_successful": False, "details": "Cannot transliterate without a clear ethnicity."}
+
+        prompt = self.PROMPT_TEMPLATE.format(name=name, ethnicity=ethnicity)
+
         try:
-            response = self.model.generate_content(
-                prompt,
-                generation_config=self.generation_config
+            return self.hedger.call(
+                lambda: _query_gemini(self.model, self.generation_config, prompt, self.hedger.attempt_timeout)
             )
-            # Clean up the response to extract only the JSON part
-            json_str = re.search(r'```json\n({.*?})\n```', response.text, re.DOTALL)
-            if json_str:
-                return json.loads(json_str.group(1))
-            else:
-                # Fallback for when the model doesn't use markdown
-                return json.loads(response.text)
         except (Exception, json.JSONDecodeError) as e:
             print(f"Error during transliteration: {e}")
-            return {"native_script": name, "transliteration_successful": False, "details": "Failed to process transliteration model response."}
+            return {"native_script": name, "transliteration_successful": False, "details": "Failed to process transliteration model response.", "error": True}
 
 
 class PronunciationGenerationAgent:
     """An agent that generates pronunciation by calling the ElevenLabs HTTP API."""
     
     TTS_URL = "https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+    TTS_MODEL_ID = "eleven_multilingual_v2"
+    VOICE_SETTINGS = {
+        "stability": 0.5,
+        "similarity_boost": 0.75,
+        "speed": 1.0
+    }
+    TTS_SEED = 123 # Use a fixed seed for deterministic output
 
     # A curated list of high-quality voices to offer on the frontend for the hackathon.
     AVAILABLE_VOICES = [
@@ -186,19 +227,37 @@ class PronunciationGenerationAgent:
             "xi-api-key": self.api_key
         }
 
+    def config_fingerprint(self, automatic_selection: bool = False) -> str:
+        """
+        Fingerprint of the TTS model, voice settings and seed.
+
+        With automatic_selection, VOICE_MAP and DEFAULT_VOICE_ID are included too,
+        since they decide which voice an ethnicity is pronounced with.
+        """
+        if automatic_selection:
+            return config_fingerprint(self.TTS_MODEL_ID, self.VOICE_SETTINGS, self.TTS_SEED, self.VOICE_MAP, self.DEFAULT_VOICE_ID)
+        return config_fingerprint(self.TTS_MODEL_ID, self.VOICE_SETTINGS, self.TTS_SEED)
+
+    def select_voice(self, ethnicity: str, voice_id: str | None = None) -> tuple[str, str]:
+        """Returns the voice_id to use and how it was selected."""
+        # If no voice_id is provided manually, use the automatic mapping
+        if voice_id:
+            return voice_id, "manual" # User provided a voice_id
+        normalized_ethnicity = ethnicity.lower().strip()
+        # Check if there is a specific mapping for this ethnicity
+        if normalized_ethnicity in self.VOICE_MAP:
+            return self.VOICE_MAP[normalized_ethnicity], "automatic_specific" # A specific mapping was found
+        return self.DEFAULT_VOICE_ID, "automatic_default" # Fell back to default
+
     def _generate_tts(self, text_to_speak: str, voice_id: str, selection_method: str) -> Dict[str, Any]:
         """Helper function to call the TTS API and save the file."""
         request_url = self.TTS_URL.format(voice_id=voice_id)
         
         data = {
             "text": text_to_speak,
-            "model_id": "eleven_multilingual_v2",
-            "voice_settings": {
-                "stability": 0.5,
-                "similarity_boost": 0.75,
-                "speed": 1.0
-            },
-            "seed": 123 # Use a fixed seed for deterministic output
+            "model_id": self.TTS_MODEL_ID,
+            "voice_settings": self.VOICE_SETTINGS,
+            "seed": self.TTS_SEED
         }
 
         try:
@@ -252,21 +311,7 @@ class PronunciationGenerationAgent:
 
         print(f"Agent: Generating TTS for '{native_script_name}' via HTTP API")
         
-        used_voice_id = voice_id
-        selection_method = "manual"
-
-        # If no voice_id is provided manually, use the automatic mapping
-        if not used_voice_id:
-            normalized_ethnicity = ethnicity.lower().strip()
-            # Check if there is a specific mapping for this ethnicity
-            if normalized_ethnicity in self.VOICE_MAP:
-                used_voice_id = self.VOICE_MAP[normalized_ethnicity]
-                selection_method = "automatic_specific" # A specific mapping was found
-            else:
-                used_voice_id = self.DEFAULT_VOICE_ID
-                selection_method = "automatic_default" # Fell back to default
-        else:
-             selection_method = "manual" # User provided a voice_id
+        used_voice_id, selection_method = self.select_voice(ethnicity, voice_id)
 
         print(f"Agent: Selected voice_id '{used_voice_id}' for ethnicity '{ethnicity}' (Method: {selection_method})")
         
@@ -0,0 +1,204 @@
+from typing import Any, Callable, Dict
+from datetime import datetime
+import json
+import os
+import queue
+import threading
+import time
+
+
+def name_key(name: str) -> str:
+    """Normalizes a name into the key used by the pronunciation cache and packs."""
+    return name.strip().lower()
+
+
+class PronunciationCache:
+    """
+    A persistent cache of agent stage results tagged with configuration fingerprints.
+
+    Each stage (e.g. "ethnicity") is registered with a function returning the
+    current fingerprint of the agent configuration and a function recomputing
+    a value from its inputs. Entries whose fingerprint no longer matches are
+    stale: they keep being served while a rate-limited background thread
+    recomputes them (stale-while-revalidate).
+
+    A read_only cache uses a snapshot of the file. It never writes the file back
+    and never revalidates in the background, so a separate process such as the
+    pack exporter can reuse the server's results without overwriting them.
+    """
+
+    def __init__(self, path: str, revalidate_interval: float = 2.0, read_only: bool = False):
+        self.path = path
+        self.revalidate_interval = revalidate_interval
+        self.read_only = read_only
+        self._stages: Dict[str, Dict[str, Callable]] = {}
+        self._lock = threading.RLock()
+        self._entries = self._load()
+        self._queue: queue.Queue = queue.Queue()
+        self._queued: set[tuple[str, str]] = set()
+        self._stats = {
+            "fresh_hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "revalidations_queued": 0,
+            "revalidations_completed": 0,
+            "revalidations_failed": 0,
+        }
+        self._last_error: str | None = None
+        if not read_only:
+            self._worker = threading.Thread(target=self._revalidate_loop, name="cache-revalidator", daemon=True)
+            self._worker.start()
+
+    def register_stage(self, stage: str, fingerprint: Callable[[], str],
+                       recompute: Callable[[Dict[str, Any]], Any],
+                       cacheable: Callable[[Any], bool] = lambda value: True,
+                       on_replace: Callable[[Any, Any], None] | None = None):
+        """
+        Registers how to fingerprint, recompute and validate the results of a stage.
+
+        cacheable is checked before storing a value and again on every hit, so
+        an entry that stops being usable is recomputed like a miss. on_replace
+        is called with the old and new value when an entry is overwritten.
+        """
+        self._stages[stage] = {
+            "fingerprint": fingerprint,
+            "recompute": recompute,
+            "cacheable": cacheable,
+            "on_replace": on_replace,
+        }
+
+    def get(self, stage: str, key: str, inputs: Dict[str, Any], allow_stale: bool = True) -> Any:
+        """
+        Returns the cached value for key, computing it on a miss.
+
+        A stale value is returned as-is and queued for background revalidation,
+        unless allow_stale is False, in which case it is recomputed like a miss.
+        """
+        handlers = self._stages[stage]
+        with self._lock:
+            entry = self._entries.get(stage, {}).get(key)
+            if entry is not None and handlers["cacheable"](entry["value"]):
+                if entry["fingerprint"] == handlers["fingerprint"]():
+                    self._stats["fresh_hits"] += 1
+                    return entry["value"]
+                if allow_stale:
+                    self._stats["stale_hits"] += 1
+                    self._enqueue(stage, key)
+                    return entry["value"]
+            self._stats["misses"] += 1
+
+        fingerprint = handlers["fingerprint"]()
+        value = handlers["recompute"](inputs)
+        self._store(stage, key, inputs, fingerprint, value)
+        return value
+
+    def values(self, stage: str) -> list[Any]:
+        """Returns every cached value of a stage, fresh or stale."""
+        with self._lock:
+            return [entry["value"] for entry in self._entries.get(stage, {}).values()]
+
+    def revalidate_stale(self) -> int:
+        """Queues every stale entry for revalidation and returns how many were queued."""
+        count = 0
+        with self._lock:
+            for stage, entries in self._entries.items():
+                if stage not in self._stages:
+                    continue
+                current = self._stages[stage]["fingerprint"]()
+                for key, entry in entries.items():
+                    if entry["fingerprint"] != current and self._enqueue(stage, key):
+                        count += 1
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit counters, the stale-hit ratio and revalidation progress."""
+        with self._lock:
+            stats = dict(self._stats)
+            stale_entries = 0
+            total_entries = 0
+            for stage, entries in self._entries.items():
+                current = self._stages[stage]["fingerprint"]() if stage in self._stages else None
+                total_entries += len(entries)
+                stale_entries += sum(1 for entry in entries.values() if entry["fingerprint"] != current)
+            pending = len(self._queued)
+        lookups = stats["fresh_hits"] + stats["stale_hits"] + stats["misses"]
+        stats["stale_hit_ratio"] = stats["stale_hits"] / lookups if lookups else 0.0
+        stats["entries"] = total_entries
+        stats["stale_entries"] = stale_entries
+        stats["revalidations_pending"] = pending
+        stats["last_error"] = self._last_error
+        return stats
+
+    def _enqueue(self, stage: str, key: str) -> bool:
+        """Queues a revalidation unless one is already pending. Caller holds the lock."""
+        if self.read_only or (stage, key) in self._queued:
+            return False
+        self._queued.add((stage, key))
+        self._stats["revalidations_queued"] += 1
+        self._queue.put((stage, key))
+        return True
+
+    def _revalidate_loop(self):
+        """Recomputes queued stale entries, at most one every revalidate_interval seconds."""
+        while True:
+            stage, key = self._queue.get()
+            try:
+                with self._lock:
+                    entry = self._entries.get(stage, {}).get(key)
+                handlers = self._stages.get(stage)
+                if entry is None or handlers is None:
+                    continue
+                fingerprint = handlers["fingerprint"]()
+                if entry["fingerprint"] == fingerprint:
+                    continue
+                print(f"Cache: Revalidating stale '{stage}' entry '{key}'.")
+                value = handlers["recompute"](entry["inputs"])
+                if not self._store(stage, key, entry["inputs"], fingerprint, value):
+                    raise ValueError("Recomputed value was not cacheable.")
+                with self._lock:
+                    self._stats["revalidations_completed"] += 1
+            except Exception as e:
+                print(f"Error revalidating cache entry '{stage}/{key}': {e}")
+                with self._lock:
+                    self._stats["revalidations_failed"] += 1
+                    self._last_error = f"{stage}/{key}: {e}"
+            finally:
+                with self._lock:
+                    self._queued.discard((stage, key))
+            time.sleep(self.revalidate_interval)
+
+    def _store(self, stage: str, key: str, inputs: Dict[str, Any], fingerprint: str, value: Any) -> bool:
+        """Saves a value if it is cacheable and persists the cache to disk."""
+        handlers = self._stages[stage]
+        if not handlers["cacheable"](value):
+            return False
+        with self._lock:
+            previous = self._entries.setdefault(stage, {}).get(key)
+            self._entries[stage][key] = {
+                "fingerprint": fingerprint,
+                "inputs": inputs,
+                "value": value,
+                "updated_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            self._save()
+        if previous is not None and handlers["on_replace"] is not None:
+            handlers["on_replace"](previous["value"], value)
+        return True
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        # Entries from the old, unversioned cache format have no fingerprint and are dropped.
+        return data.get("stages", {}) if isinstance(data, dict) else {}
+
+    def _save(self):
+        if self.read_only:
+            return
+        # Write to a temporary file first so a crash never leaves a truncated cache.
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"stages": self._entries}, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
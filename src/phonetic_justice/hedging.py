@@ -0,0 +1,199 @@
+from typing import Any, Callable, Dict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import os
+import threading
+import time
+
+
+class HedgedCaller:
+    """
+    Runs a blocking call with optional request hedging to cut tail latency.
+
+    If the primary call has not finished after a delay taken from a percentile
+    of recently observed latencies, an identical backup call is issued and the
+    first valid result wins. A call counts as valid when it returns without
+    raising. Hedging is only safe for idempotent, deterministic calls.
+
+    Losing attempts keep running until they finish, so callers should pass
+    attempt_timeout to the underlying request to bound how long a loser can
+    hold a worker. When every worker is busy, calls run inline rather than
+    queueing behind stalled attempts.
+    """
+
+    def __init__(self, name: str, enabled: bool = False, percentile: float = 95.0,
+                 min_delay: float = 0.5, max_hedge_rate: float = 0.1, hedge_burst: float = 2.0,
+                 attempt_timeout: float = 30.0, window_size: int = 200, min_samples: int = 20,
+                 max_workers: int = 8):
+        self.name = name
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_hedge_rate = max_hedge_rate
+        self.hedge_burst = hedge_burst
+        self.attempt_timeout = attempt_timeout
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        self._latencies = deque(maxlen=window_size)
+        self._queue_waits = deque(maxlen=window_size)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        # Token bucket: each call earns max_hedge_rate tokens and each hedge
+        # spends one, so the hedge rate stays capped over recent traffic.
+        self._hedge_tokens = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"hedge-{name}")
+        self._stats = {
+            "calls": 0,
+            "hedges_sent": 0,
+            "hedges_won": 0,
+            "hedges_denied_by_budget": 0,
+            "hedges_skipped_pool_full": 0,
+            "inline_calls": 0,
+            "failures": 0,
+        }
+
+    @classmethod
+    def from_env(cls, name: str) -> "HedgedCaller":
+        """Builds a caller configured by the GEMINI_HEDGE_* environment variables."""
+        return cls(
+            name,
+            enabled=os.getenv("GEMINI_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes"),
+            percentile=float(os.getenv("GEMINI_HEDGE_PERCENTILE", "95")),
+            min_delay=float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "0.5")),
+            max_hedge_rate=float(os.getenv("GEMINI_HEDGE_MAX_RATE", "0.1")),
+            hedge_burst=float(os.getenv("GEMINI_HEDGE_BURST", "2")),
+            attempt_timeout=float(os.getenv("GEMINI_ATTEMPT_TIMEOUT", "30")),
+        )
+
+    def hedge_delay(self) -> float:
+        """Returns how long to wait on the primary call before hedging."""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.min_samples:
+            # Not enough history yet: wait long enough that hedges stay rare.
+            return max(self.min_delay, samples[-1] if samples else self.min_delay)
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100.0))
+        return max(self.min_delay, samples[index])
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """
+        Runs fn, hedging it with a second identical call if it is slow.
+
+        Returns:
+            The result of whichever attempt first completes without raising.
+            If every attempt raises, the last exception is re-raised.
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            self._hedge_tokens = min(self.hedge_burst, self._hedge_tokens + self.max_hedge_rate)
+
+        if not self.enabled:
+            return self._timed(fn)
+
+        primary = self._submit(fn)
+        if primary is None:
+            # Every worker is busy, most likely with stalled attempts; waiting
+            # in the queue would only add to the latency hedging tries to cut.
+            with self._lock:
+                self._stats["inline_calls"] += 1
+            return self._timed(fn)
+
+        done, _ = wait([primary], timeout=self.hedge_delay())
+        if done:
+            # A call that fails before the hedge delay is not slow; hedging is
+            # not a retry, so its error propagates unchanged.
+            if primary.exception() is not None:
+                with self._lock:
+                    self._stats["failures"] += 1
+            return primary.result()
+
+        pending = {primary}
+        errors = []
+        hedge = None
+        if self._reserve_hedge():
+            hedge = self._submit(fn)
+            if hedge is None:
+                with self._lock:
+                    self._stats["hedges_sent"] -= 1
+                    self._stats["hedges_skipped_pool_full"] += 1
+                    self._hedge_tokens += 1.0
+            else:
+                print(f"Hedging: '{self.name}' call exceeded hedge delay, sending backup request.")
+                pending.add(hedge)
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                    continue
+                # The loser cannot be interrupted mid-request; cancel it if it
+                # has not started, otherwise attempt_timeout ends it.
+                for other in pending:
+                    other.cancel()
+                if future is hedge:
+                    with self._lock:
+                        self._stats["hedges_won"] += 1
+                return future.result()
+
+        with self._lock:
+            self._stats["failures"] += 1
+        raise errors[-1]
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hedging counters and the current hedge delay."""
+        with self._lock:
+            stats = dict(self._stats)
+            sample_count = len(self._latencies)
+            queue_waits = list(self._queue_waits)
+            stats["in_flight"] = self._in_flight
+        stats["name"] = self.name
+        stats["enabled"] = self.enabled
+        stats["hedge_rate"] = stats["hedges_sent"] / stats["calls"] if stats["calls"] else 0.0
+        stats["hedge_delay_seconds"] = self.hedge_delay()
+        stats["hedge_tokens"] = self._hedge_tokens
+        stats["latency_samples"] = sample_count
+        stats["avg_queue_wait_seconds"] = sum(queue_waits) / len(queue_waits) if queue_waits else 0.0
+        stats["max_queue_wait_seconds"] = max(queue_waits, default=0.0)
+        return stats
+
+    def _submit(self, fn: Callable[[], Any]):
+        """Runs fn on the pool, or returns None if every worker is already busy."""
+        with self._lock:
+            if self._in_flight >= self.max_workers:
+                return None
+            self._in_flight += 1
+        future = self._executor.submit(self._timed, fn, time.monotonic())
+        # Runs on completion and on cancellation, so cancelled attempts free their slot too.
+        future.add_done_callback(self._release_worker)
+        return future
+
+    def _release_worker(self, future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _timed(self, fn: Callable[[], Any], submitted_at: float | None = None) -> Any:
+        """
+        Runs fn and records its latency when it succeeds.
+
+        Time spent waiting for a pool worker is recorded separately, so it
+        never inflates the latency samples the hedge delay is derived from.
+        """
+        start = time.monotonic()
+        if submitted_at is not None:
+            with self._lock:
+                self._queue_waits.append(start - submitted_at)
+        result = fn()
+        with self._lock:
+            self._latencies.append(time.monotonic() - start)
+        return result
+
+    def _reserve_hedge(self) -> bool:
+        """Spends a hedge token, keeping hedges under max_hedge_rate of recent calls."""
+        with self._lock:
+            if self._hedge_tokens < 1.0:
+                self._stats["hedges_denied_by_budget"] += 1
+                return False
+            self._hedge_tokens -= 1.0
+            self._stats["hedges_sent"] += 1
+            return True
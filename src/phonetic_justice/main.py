@@ -1,19 +1,42 @@
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from fastapi import HTTPException
 from pydantic import BaseModel, Field
 import os
 import json
 import asyncio
+import time
 from typing import Any, Dict
+from urllib.parse import quote
 
 from .agents import EthnicityDetectionAgent, PronunciationGenerationAgent, NameTransliterationAgent
+from .cache import PronunciationCache
+from .pack import PackStore
+from .pipeline import PronunciationPipeline, static_dir, cache_file
+
+# Read-mostly replicas serve known names from a memory-mapped pronunciation pack.
+pack_store = PackStore()
+if os.getenv("PRONUNCIATION_PACK"):
+    pack_store.load(os.getenv("PRONUNCIATION_PACK"))
+
+# Packs can only be hot-swapped from this directory. It defaults to the
+# directory of PRONUNCIATION_PACK; without either, hot-swapping is disabled.
+pack_dir = os.getenv("PRONUNCIATION_PACK_DIR") or (
+    os.path.dirname(os.path.abspath(os.getenv("PRONUNCIATION_PACK"))) if os.getenv("PRONUNCIATION_PACK") else None
+)
 
 # Initialize Agents
-ethnicity_agent = EthnicityDetectionAgent()
-transliteration_agent = NameTransliterationAgent()
-pronunciation_agent = PronunciationGenerationAgent()
+try:
+    ethnicity_agent = EthnicityDetectionAgent()
+    transliteration_agent = NameTransliterationAgent()
+    pronunciation_agent = PronunciationGenerationAgent()
+except ValueError as e:
+    # A replica with a pack may run without provider API keys.
+    if pack_store.current is None:
+        raise
+    print(f"Agents unavailable, serving pronunciation pack hits only: {e}")
+    ethnicity_agent = transliteration_agent = pronunciation_agent = None
 
 app = FastAPI(
     title="Phonetic Justice API",
@@ -21,14 +44,74 @@ app = FastAPI(
     version="0.1.0",
 )
 
-# Determine the path to the static directory and cache file
-base_dir = os.path.dirname(os.path.abspath(__file__))
-static_dir = os.path.join(base_dir, "..", "..", "static")
-cache_file = os.path.join(base_dir, "..", "..", "data", "pronunciation_cache.json")
-
 # Mount the static directory
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
+audio_dir = os.path.join(static_dir, "audio")
+
+# Replaced clips may still be playing in a browser or linked from the admin
+# panel, so they are only deleted by a sweep once this grace period has passed.
+AUDIO_DELETE_GRACE = float(os.getenv("AUDIO_DELETE_GRACE", "3600"))
+AUDIO_SWEEP_INTERVAL = float(os.getenv("AUDIO_SWEEP_INTERVAL", "600"))
+
+def retire_replaced_audio(old_result: Dict[str, Any], new_result: Dict[str, Any]):
+    """Marks the clip of a replaced audio result for deletion by the sweep."""
+    old_path = old_result.get("audio_output")
+    if old_path and old_path != new_result.get("audio_output"):
+        try:
+            # The modification time records when the clip was retired.
+            os.utime(os.path.join(audio_dir, os.path.basename(old_path)))
+        except FileNotFoundError:
+            pass
+
+def sweep_replaced_audio() -> int:
+    """
+    Deletes generated clips that nothing references any more.
+
+    A clip is kept while a cache entry or an admin record links to it, and
+    for AUDIO_DELETE_GRACE seconds after it was generated or retired.
+
+    Returns:
+        The number of clips deleted.
+    """
+    referenced = {record.get("audio_path") for record in names_database}
+    if pipeline is not None:
+        referenced.update(result.get("audio_output") for result in pipeline.audio_results())
+    referenced_files = {os.path.basename(path) for path in referenced if path}
+
+    cutoff = time.time() - AUDIO_DELETE_GRACE
+    deleted = 0
+    for filename in os.listdir(audio_dir) if os.path.isdir(audio_dir) else []:
+        file_path = os.path.join(audio_dir, filename)
+        if not filename.startswith("pronunciation_") or filename in referenced_files:
+            continue
+        try:
+            if os.path.getmtime(file_path) < cutoff:
+                os.remove(file_path)
+                deleted += 1
+        except FileNotFoundError:
+            pass
+    if deleted:
+        print(f"Cache: Deleted {deleted} unreferenced audio clips.")
+    return deleted
+
+# Stage results and audio clips are cached with a fingerprint of the agent
+# configuration that produced them. Stale entries are served while they are
+# recomputed in the background.
+cache = PronunciationCache(
+    cache_file,
+    revalidate_interval=float(os.getenv("CACHE_REVALIDATE_INTERVAL", "2.0"))
+)
+pipeline = None
+if ethnicity_agent is not None:
+    pipeline = PronunciationPipeline(
+        cache,
+        ethnicity_agent,
+        transliteration_agent,
+        pronunciation_agent,
+        on_audio_replace=retire_replaced_audio
+    )
+
 class EthnicityResult(BaseModel):
     ethnicity: str
     confidence: float
@@ -75,6 +158,48 @@ class PronunciationOutput(BaseModel):
 names_database = []
 next_id = 1
 
+def require_pipeline() -> PronunciationPipeline:
+    """Returns the live pipeline, or raises a 503 on a pack-only replica."""
+    if pipeline is None:
+        raise HTTPException(status_code=503, detail="Name not in pronunciation pack and no agents are configured.")
+    return pipeline
+
+def lookup_pack(name: str, voice_id: str | None = None) -> PronunciationOutput | None:
+    """Returns the packed pronunciation for a name, or None on a pack miss."""
+    pack = pack_store.current
+    record = pack.lookup(name) if pack else None
+    if record is None or (voice_id or record["auto_voice_id"]) not in record["audio"]:
+        if pack:
+            pack_store.record_lookup(hit=False)
+        return None
+    pack_store.record_lookup(hit=True)
+
+    used_voice_id = voice_id or record["auto_voice_id"]
+    audio_url = f"/pack/audio?name={quote(name)}&voice_id={quote(used_voice_id)}&v={quote(str(pack.version))}"
+    return PronunciationOutput(
+        ethnicity_result=record["ethnicity_result"],
+        transliteration_result=record["transliteration_result"],
+        pronunciation_result={
+            "audio_output": audio_url,
+            "status": "success",
+            "details": f"Audio served from pronunciation pack '{pack.version}'.",
+            "voice_id_used": used_voice_id,
+            "selection_method": "manual" if voice_id else record.get("auto_selection_method"),
+        }
+    )
+
+@app.on_event("startup")
+async def start_audio_sweep():
+    """Periodically deletes replaced clips once their grace period is over."""
+    async def sweep_loop():
+        while True:
+            await asyncio.sleep(AUDIO_SWEEP_INTERVAL)
+            try:
+                sweep_replaced_audio()
+            except OSError as e:
+                print(f"Error sweeping audio clips: {e}")
+    asyncio.create_task(sweep_loop())
+
 @app.get("/", response_class=FileResponse)
 def read_index():
     """Serves the main index.html file."""
@@ -92,19 +217,82 @@ async def get_voices():
     all_voices = []
     
     # Add specialized voices with a category label
-    for voice in pronunciation_agent.AVAILABLE_VOICES:
+    for voice in PronunciationGenerationAgent.AVAILABLE_VOICES:
         voice_with_category = voice.copy()
         voice_with_category['category'] = 'Specialized'
         all_voices.append(voice_with_category)
     
     # Add general voices with a category label
-    for voice in pronunciation_agent.GENERAL_VOICES:
+    for voice in PronunciationGenerationAgent.GENERAL_VOICES:
         voice_with_category = voice.copy()
         voice_with_category['category'] = 'General'
         all_voices.append(voice_with_category)
     
     return all_voices
 
+@app.get("/api/metrics/hedging")
+async def get_hedging_metrics():
+    """Returns request hedging counters for the Gemini-backed agents."""
+    return [agent.hedger.stats() for agent in (ethnicity_agent, transliteration_agent) if agent is not None]
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Returns cache hit counters, the stale-hit ratio and revalidation progress."""
+    return cache.stats()
+
+@app.post("/api/cache/revalidate")
+async def revalidate_cache():
+    """Queues every stale cache entry for background revalidation."""
+    queued = cache.revalidate_stale()
+    return {"queued": queued, "stats": cache.stats()}
+
+@app.get("/api/pack")
+async def get_pack_stats():
+    """Returns the active pronunciation pack and its hit counters."""
+    return pack_store.stats()
+
+@app.post("/api/pack/load")
+async def load_pack(data: dict):
+    """
+    Loads a pronunciation pack and swaps it in for the active one.
+
+    The path is resolved relative to the pack directory, and paths that
+    resolve outside it are rejected.
+    """
+    if not pack_dir:
+        raise HTTPException(status_code=403, detail="Pack loading is not configured")
+    if not isinstance(data.get("path"), str):
+        raise HTTPException(status_code=400, detail="A pack path is required")
+
+    root = os.path.realpath(pack_dir)
+    path = os.path.realpath(os.path.join(root, data["path"]))
+    if os.path.commonpath([root, path]) != root:
+        raise HTTPException(status_code=400, detail="Pack path must be inside the pack directory")
+    try:
+        pack_store.load(path)
+    except (OSError, ValueError) as e:
+        # Details stay in the server log so responses do not reveal the file system.
+        print(f"Error loading pack '{path}': {e}")
+        raise HTTPException(status_code=400, detail="Failed to load pack")
+    return pack_store.stats()
+
+@app.get("/pack/audio")
+async def get_pack_audio(name: str, voice_id: str, v: str | None = None):
+    """
+    Serves an audio clip straight from the memory-mapped pronunciation pack.
+
+    v pins the pack version the URL was issued for, so a URL from before a
+    hot-swap never returns a clip from a different pack.
+    """
+    pack = pack_store.current
+    if pack and v is not None and v != str(pack.version):
+        raise HTTPException(status_code=410, detail="Pronunciation pack has been replaced")
+    record = pack.lookup(name) if pack else None
+    audio = pack.audio(record, voice_id) if record else None
+    if audio is None:
+        raise HTTPException(status_code=404, detail="Audio not found in pronunciation pack")
+    return Response(content=audio, media_type="audio/mpeg")
+
 @app.get("/api/names")
 async def get_all_names():
     """Returns all names in the database for the admin panel."""
@@ -177,20 +365,16 @@ async def bulk_process_names(data: dict):
             continue
             
         try:
-            # Step 1: Detect ethnicity
-            ethnicity_result = ethnicity_agent.run(name)
+            # Steps 1 and 2: Detect ethnicity and transliterate
+            ethnicity_result, transliteration_result, name_to_pronounce = require_pipeline().run_text_pipeline(name)
             detected_ethnicity = ethnicity_result.get("ethnicity", "Uncertain")
-            
-            # Step 2: Transliterate name to native script
-            transliteration_result = transliteration_agent.run(name, detected_ethnicity)
             native_script = transliteration_result.get("native_script", name)
             
             # Step 3: Optionally generate pronunciation
             audio_path = None
             if generate_pronunciations:
                 try:
-                    name_to_pronounce = native_script if transliteration_result.get("transliteration_successful") else name
-                    pronunciation_result = pronunciation_agent.run(
+                    pronunciation_result = require_pipeline().generate_pronunciation(
                         name_to_pronounce,
                         detected_ethnicity
                     )
@@ -238,24 +422,14 @@ async def get_all_pronunciations(data: NameInput):
     """
     Generates pronunciations from all available voices for a given name.
     """
-    # Step 1: Detect ethnicity
-    ethnicity_result = ethnicity_agent.run(data.name)
-    detected_ethnicity = ethnicity_result.get("ethnicity", "Uncertain")
-
-    # Step 2: Transliterate name to native script
-    transliteration_result = transliteration_agent.run(data.name, detected_ethnicity)
-    
-    # Determine which name to use for pronunciation
-    if transliteration_result.get("transliteration_successful"):
-        name_to_pronounce = transliteration_result.get("native_script", data.name)
-    else:
-        name_to_pronounce = data.name # Fallback to original name
+    # Steps 1 and 2: Detect ethnicity and transliterate
+    ethnicity_result, transliteration_result, name_to_pronounce = require_pipeline().run_text_pipeline(data.name)
 
     # Step 3: Generate pronunciation from all available voices
-    pronunciation_results = pronunciation_agent.run(
+    pronunciation_results = require_pipeline().generate_pronunciations_for_voices(
         name_to_pronounce,
-        detected_ethnicity,
-        generate_for_all_available=True
+        pronunciation_agent.AVAILABLE_VOICES,
+        "specialized"
     )
 
     # Combine results
@@ -272,25 +446,14 @@ async def get_general_pronunciations(data: NameInput):
     """
     Generates pronunciations from all general voices for a given name.
     """
-    # Step 1: Detect ethnicity
-    ethnicity_result = ethnicity_agent.run(data.name)
-    detected_ethnicity = ethnicity_result.get("ethnicity", "Uncertain")
-
-    # Step 2: Transliterate name to native script
-    transliteration_result = transliteration_agent.run(data.name, detected_ethnicity)
-    
-    # Determine which name to use for pronunciation
-    if transliteration_result.get("transliteration_successful"):
-        name_to_pronounce = transliteration_result.get("native_script", data.name)
-    else:
-        name_to_pronounce = data.name # Fallback to original name
+    # Steps 1 and 2: Detect ethnicity and transliterate
+    ethnicity_result, transliteration_result, name_to_pronounce = require_pipeline().run_text_pipeline(data.name)
 
     # Step 3: Generate pronunciation from all general voices
-    pronunciation_results = pronunciation_agent.run(
+    pronunciation_results = require_pipeline().generate_pronunciations_for_voices(
         name_to_pronounce,
-        detected_ethnicity,
-        generate_for_all_available=True,
-        use_general_voices=True
+        pronunciation_agent.GENERAL_VOICES,
+        "general"
     )
 
     # Combine results
@@ -305,43 +468,22 @@ async def get_general_pronunciations(data: NameInput):
 @app.post("/pronounce", response_model=PronunciationOutput)
 async def get_pronunciation(data: NameInput):
     """
-    Takes a name, checks cache, and uses agents to get pronunciation.
+    Takes a name, checks the pronunciation pack, and otherwise uses the
+    cached agent pipeline to get pronunciation.
     """
-    # Caching logic is temporarily disabled.
-    # # Load cache
-    # try:
-    #     with open(cache_file, 'r') as f:
-    #         cache = json.load(f)
-    # except (FileNotFoundError, json.JSONDecodeError):
-    #     cache = {}
-
-    # # Check if name is in cache
-    # if data.name.lower() in cache:
-    #     # Ensure cached data conforms to the model
-    #     try:
-    #         return PronunciationOutput(**cache[data.name.lower()])
-    #     except Exception:
-    #         # If cache is old format, proceed to regenerate
-    #         pass
+    packed_result = lookup_pack(data.name, data.voice_id)
+    if packed_result is not None:
+        return packed_result
 
     # Simulate thinking time and run agents
     await asyncio.sleep(1.5) # Simulates network/model latency
 
-    # Step 1: Detect ethnicity
-    ethnicity_result = ethnicity_agent.run(data.name)
+    # Steps 1 and 2: Detect ethnicity and transliterate
+    ethnicity_result, transliteration_result, name_to_pronounce = require_pipeline().run_text_pipeline(data.name)
     detected_ethnicity = ethnicity_result.get("ethnicity", "Uncertain")
 
-    # Step 2: Transliterate name to native script
-    transliteration_result = transliteration_agent.run(data.name, detected_ethnicity)
-    
-    # Determine which name to use for pronunciation
-    if transliteration_result.get("transliteration_successful"):
-        name_to_pronounce = transliteration_result.get("native_script", data.name)
-    else:
-        name_to_pronounce = data.name # Fallback to original name
-
     # Step 3: Generate pronunciation
-    pronunciation_result = pronunciation_agent.run(
+    pronunciation_result = require_pipeline().generate_pronunciation(
         name_to_pronounce,
         detected_ethnicity,
         voice_id=data.voice_id
@@ -362,10 +504,4 @@ async def get_pronunciation(data: NameInput):
         # Handle error case, maybe return an error response
         raise
 
-    # Caching logic is temporarily disabled.
-    # # Save updated cache
-    # cache[data.name.lower()] = validated_result.model_dump()
-    # with open(cache_file, 'w') as f:
-    #     json.dump(cache, f, indent=4)
-
     return validated_result 
\ No newline at end of file
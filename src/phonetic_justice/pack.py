@@ -0,0 +1,333 @@
+from typing import Any, Dict, Iterable
+from datetime import datetime
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+
+from .cache import name_key
+
+# File layout (all integers little-endian):
+#   header    magic, format version, metadata length, entry count, index offset,
+#             audio section length
+#   metadata  JSON: pack version, creation time, agent config fingerprints
+#   index     one fixed-size record per name, sorted by key
+#   keys      UTF-8 name keys
+#   records   JSON stage results plus (offset, length) of each audio clip
+#   audio     concatenated MP3 blobs
+MAGIC = b"PJPK"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<4sHHIIQQ")
+INDEX_ENTRY = struct.Struct("<QIQI")
+
+
+def write_pack(entries: Dict[str, Dict[str, Any]], output_path: str, metadata: Dict[str, Any]) -> int:
+    """
+    Writes a pronunciation pack.
+
+    Args:
+        entries: Maps a name to its record: "ethnicity_result", "transliteration_result",
+            "auto_voice_id", "auto_selection_method" and "audio", a dict of voice_id
+            to MP3 bytes.
+        output_path: Where to write the pack. The file is replaced atomically.
+        metadata: Pack metadata such as "pack_version" and agent fingerprints.
+
+    Returns:
+        The number of entries written.
+    """
+    keys = sorted({name_key(name): name for name in entries}.items(), key=lambda item: item[0].encode("utf-8"))
+    metadata_bytes = json.dumps(metadata, ensure_ascii=False).encode("utf-8")
+    index_offset = HEADER.size + len(metadata_bytes)
+    keys_offset = index_offset + INDEX_ENTRY.size * len(keys)
+
+    key_blobs = [key.encode("utf-8") for key, _ in keys]
+    records_offset = keys_offset + sum(len(blob) for blob in key_blobs)
+
+    # Audio positions are stored relative to the audio section, because its
+    # absolute offset depends on the size of the records that contain them.
+    audio_blobs = []
+    relative_records = []
+    audio_cursor = 0
+    for _, name in keys:
+        entry = entries[name]
+        audio_positions = {}
+        for voice_id, audio_bytes in entry.get("audio", {}).items():
+            audio_positions[voice_id] = [audio_cursor, len(audio_bytes)]
+            audio_blobs.append(audio_bytes)
+            audio_cursor += len(audio_bytes)
+        relative_records.append({
+            "name": name,
+            "ethnicity_result": entry["ethnicity_result"],
+            "transliteration_result": entry["transliteration_result"],
+            "auto_voice_id": entry.get("auto_voice_id"),
+            "auto_selection_method": entry.get("auto_selection_method"),
+            "audio": audio_positions,
+        })
+
+    record_blobs = [json.dumps(record, ensure_ascii=False).encode("utf-8") for record in relative_records]
+    audio_offset = records_offset + sum(len(blob) for blob in record_blobs)
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(metadata_bytes), len(keys), index_offset, audio_cursor))
+        f.write(metadata_bytes)
+        key_cursor = keys_offset
+        record_cursor = records_offset
+        for key_blob, record_blob in zip(key_blobs, record_blobs):
+            f.write(INDEX_ENTRY.pack(key_cursor, len(key_blob), record_cursor, len(record_blob)))
+            key_cursor += len(key_blob)
+            record_cursor += len(record_blob)
+        for blob in key_blobs:
+            f.write(blob)
+        for blob in record_blobs:
+            f.write(blob)
+        assert f.tell() == audio_offset
+        for blob in audio_blobs:
+            f.write(blob)
+    os.replace(tmp_path, output_path)
+    return len(keys)
+
+
+class PronunciationPack:
+    """
+    A read-only, memory-mapped pronunciation pack.
+
+    Lookups binary-search the sorted key index directly in the mapping, and
+    audio is returned as a memoryview into it, so clips are never copied.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise ValueError(f"'{path}' is too small to be a pronunciation pack.")
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_header()
+        except (struct.error, ValueError) as e:
+            # JSON and UTF-8 decoding errors are ValueErrors too.
+            self._mm.close()
+            raise ValueError(f"'{path}' is not a valid pronunciation pack: {e}") from e
+
+    def _read_header(self):
+        """Parses the header and metadata and checks every index entry against its section."""
+        (magic, format_version, _, metadata_length, self.entry_count,
+         self._index_offset, self._audio_length) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError("bad magic number")
+        if format_version != FORMAT_VERSION:
+            raise ValueError(f"unsupported format version {format_version}")
+        if self._index_offset != HEADER.size + metadata_length:
+            raise ValueError("index does not follow the metadata")
+        keys_offset = self._index_offset + self.entry_count * INDEX_ENTRY.size
+        self._audio_offset = len(self._mm) - self._audio_length
+        if keys_offset > self._audio_offset:
+            raise ValueError("file is truncated")
+        self.metadata = json.loads(self._mm[HEADER.size:self._index_offset])
+        self.version = self.metadata.get("pack_version")
+
+        # Keys and records are written back to back in index order, so each
+        # entry must start exactly where the previous one ended.
+        records_offset = keys_offset + sum(self._index_entry(i)[1] for i in range(self.entry_count))
+        key_cursor, record_cursor = keys_offset, records_offset
+        for position in range(self.entry_count):
+            key_offset, key_length, record_offset, record_length = self._index_entry(position)
+            if key_offset != key_cursor or record_offset != record_cursor:
+                raise ValueError(f"index entry {position} is out of place")
+            key_cursor += key_length
+            record_cursor += record_length
+        # Audio length comes from the header, so a truncated tail fails here.
+        if record_cursor != self._audio_offset:
+            raise ValueError("file is truncated or has trailing data")
+
+    def lookup(self, name: str) -> Dict[str, Any] | None:
+        """Returns the stored record for a name, or None if it is not in the pack."""
+        target = name_key(name).encode("utf-8")
+        low, high = 0, self.entry_count
+        while low < high:
+            middle = (low + high) // 2
+            key_offset, key_length, record_offset, record_length = self._index_entry(middle)
+            key = self._mm[key_offset:key_offset + key_length]
+            if key == target:
+                try:
+                    return json.loads(self._mm[record_offset:record_offset + record_length])
+                except ValueError as e:
+                    # A damaged record is served as a miss, so the live pipeline answers instead.
+                    print(f"Pack: Corrupt record for '{name}' in '{self.path}': {e}")
+                    return None
+            if key < target:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def audio(self, record: Dict[str, Any], voice_id: str) -> memoryview | None:
+        """Returns a zero-copy view of a record's audio clip for voice_id, if packed."""
+        position = record["audio"].get(voice_id)
+        if position is None:
+            return None
+        offset, length = position
+        if offset < 0 or length < 0 or offset + length > self._audio_length:
+            return None
+        start = self._audio_offset + offset
+        return memoryview(self._mm)[start:start + length]
+
+    def _index_entry(self, position: int) -> tuple[int, int, int, int]:
+        return INDEX_ENTRY.unpack_from(self._mm, self._index_offset + position * INDEX_ENTRY.size)
+
+
+class PackStore:
+    """Holds the active pronunciation pack and swaps in new ones atomically."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pack: PronunciationPack | None = None
+        self._stats = {"hits": 0, "misses": 0, "loads": 0}
+
+    @property
+    def current(self) -> PronunciationPack | None:
+        return self._pack
+
+    def load(self, path: str) -> PronunciationPack:
+        """
+        Opens a pack and makes it the active one.
+
+        The previous pack is not closed explicitly: requests still holding it or
+        its audio views keep working, and the mapping is released once they finish.
+        """
+        pack = PronunciationPack(path)
+        with self._lock:
+            self._pack = pack
+            self._stats["loads"] += 1
+        print(f"Pack: Loaded '{path}' (version {pack.version}, {pack.entry_count} names).")
+        return pack
+
+    def record_lookup(self, hit: bool):
+        with self._lock:
+            self._stats["hits" if hit else "misses"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns hit counters and details of the active pack."""
+        with self._lock:
+            stats = dict(self._stats)
+            pack = self._pack
+        stats["path"] = pack.path if pack else None
+        stats["version"] = pack.version if pack else None
+        stats["entries"] = pack.entry_count if pack else 0
+        stats["metadata"] = pack.metadata if pack else None
+        return stats
+
+
+def load_roster(path: str) -> list[str]:
+    """Reads names from a JSON list, or from a dict of groups like data/test_names.json."""
+    with open(path, "r", encoding="utf-8") as f:
+        roster = json.load(f)
+    if isinstance(roster, dict):
+        return [name for names in roster.values() for name in names]
+    return list(roster)
+
+
+def export_roster(names: Iterable[str], output_path: str, pack_version: str, all_voices: bool = False) -> tuple[int, list[str]]:
+    """
+    Runs a roster through the agent pipeline and writes the results to a pack.
+
+    Requires provider API keys. Results come from a read-only snapshot of the
+    server's cache: up-to-date entries are reused, and stale ones are recomputed
+    so the pack matches the fingerprints it is stamped with. The server's
+    cache file and clips are never modified. Names whose results failed are
+    left out so replicas fall back to the live pipeline for them.
+
+    Returns:
+        The number of names written and the names that were skipped.
+    """
+    # Imported here so replicas that only read packs never import the agents.
+    from .agents import EthnicityDetectionAgent, PronunciationGenerationAgent, NameTransliterationAgent
+    from .cache import PronunciationCache
+    from .pipeline import PronunciationPipeline, cache_file
+
+    pipeline = PronunciationPipeline(
+        PronunciationCache(cache_file, read_only=True),
+        EthnicityDetectionAgent(),
+        NameTransliterationAgent(),
+        PronunciationGenerationAgent()
+    )
+    pronunciation_agent = pipeline.pronunciation_agent
+
+    entries = {}
+    skipped = []
+    for name in names:
+        ethnicity_result, transliteration_result, name_to_pronounce = pipeline.run_text_pipeline(name, allow_stale=False)
+        if ethnicity_result.get("error") or transliteration_result.get("error"):
+            print(f"Export: Agents failed for '{name}', skipping name.")
+            skipped.append(name)
+            continue
+        detected_ethnicity = ethnicity_result.get("ethnicity", "Uncertain")
+        auto_voice_id, auto_selection_method = pronunciation_agent.select_voice(detected_ethnicity)
+
+        # The automatic voice comes from the per-ethnicity cache stage, like /pronounce.
+        results = [pipeline.generate_pronunciation(name_to_pronounce, detected_ethnicity, allow_stale=False)]
+        if all_voices:
+            voice_list = pronunciation_agent.AVAILABLE_VOICES + pronunciation_agent.GENERAL_VOICES
+            results += [
+                pipeline.generate_pronunciation(name_to_pronounce, detected_ethnicity, voice['voice_id'], allow_stale=False)
+                for voice in voice_list if voice['voice_id'] != auto_voice_id
+            ]
+
+        audio = {}
+        for result in results:
+            voice_id = result.get("voice_id_used")
+            if not result.get("audio_output"):
+                print(f"Export: No audio for '{name}' with voice '{voice_id}', skipping clip.")
+                continue
+            try:
+                with open(pipeline.audio_file_path(result["audio_output"]), "rb") as f:
+                    audio[voice_id] = f.read()
+            except FileNotFoundError:
+                print(f"Export: Audio file for '{name}' with voice '{voice_id}' is missing, skipping clip.")
+
+        # /pronounce serves the automatic voice, so a name without it is useless in the pack.
+        if auto_voice_id not in audio:
+            print(f"Export: No clip for the automatic voice of '{name}', skipping name.")
+            skipped.append(name)
+            continue
+
+        entries[name] = {
+            "ethnicity_result": ethnicity_result,
+            "transliteration_result": transliteration_result,
+            "auto_voice_id": auto_voice_id,
+            "auto_selection_method": auto_selection_method,
+            "audio": audio,
+        }
+        print(f"Export: Packed '{name}' ({len(audio)} clips).")
+
+    metadata = {
+        "pack_version": pack_version,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "fingerprints": {
+            "ethnicity": pipeline.ethnicity_agent.config_fingerprint(),
+            "transliteration": pipeline.transliteration_agent.config_fingerprint(),
+            "audio": pronunciation_agent.config_fingerprint(),
+            "auto_audio": pronunciation_agent.config_fingerprint(automatic_selection=True),
+        },
+    }
+    return write_pack(entries, output_path, metadata), skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a roster of names to a pronunciation pack.")
+    parser.add_argument("roster", help="JSON list of names, or a dict of name groups.")
+    parser.add_argument("output", help="Path of the pack file to write.")
+    parser.add_argument("--pack-version", default=datetime.now().strftime("%Y%m%d_%H%M%S"),
+                        help="Version label stored in the pack (defaults to a timestamp).")
+    parser.add_argument("--all-voices", action="store_true",
+                        help="Pack clips for every available voice, not only the automatic one.")
+    args = parser.parse_args()
+
+    count, skipped = export_roster(load_roster(args.roster), args.output, args.pack_version, args.all_voices)
+    print(f"Export: Wrote {count} names to '{args.output}'.")
+    if skipped:
+        print(f"Export: Skipped {len(skipped)} names: {', '.join(skipped)}")
+        sys.exit(1)
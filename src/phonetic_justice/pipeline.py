@@ -0,0 +1,128 @@
+from typing import Any, Callable, Dict
+import os
+
+from .agents import EthnicityDetectionAgent, PronunciationGenerationAgent, NameTransliterationAgent
+from .cache import PronunciationCache, name_key
+
+# Determine the path to the static directory and cache file
+base_dir = os.path.dirname(os.path.abspath(__file__))
+static_dir = os.path.join(base_dir, "..", "..", "static")
+cache_file = os.path.join(base_dir, "..", "..", "data", "pronunciation_cache.json")
+
+
+class PronunciationPipeline:
+    """
+    Runs the three agents behind a PronunciationCache.
+
+    Stage results and audio clips are cached with a fingerprint of the agent
+    configuration that produced them.
+    """
+
+    def __init__(self, cache: PronunciationCache,
+                 ethnicity_agent: EthnicityDetectionAgent,
+                 transliteration_agent: NameTransliterationAgent,
+                 pronunciation_agent: PronunciationGenerationAgent,
+                 on_audio_replace: Callable[[Dict[str, Any], Dict[str, Any]], None] | None = None):
+        self.cache = cache
+        self.ethnicity_agent = ethnicity_agent
+        self.transliteration_agent = transliteration_agent
+        self.pronunciation_agent = pronunciation_agent
+        self.audio_dir = os.path.join(static_dir, "audio")
+
+        cache.register_stage(
+            "ethnicity",
+            ethnicity_agent.config_fingerprint,
+            lambda inputs: ethnicity_agent.run(inputs["name"]),
+            cacheable=lambda result: not result.get("error")
+        )
+        cache.register_stage(
+            "transliteration",
+            transliteration_agent.config_fingerprint,
+            lambda inputs: transliteration_agent.run(inputs["name"], inputs["ethnicity"]),
+            # Failed model calls fall back to the original name and should be retried.
+            cacheable=lambda result: not result.get("error")
+        )
+        # Manually chosen voices are cached per voice_id.
+        cache.register_stage(
+            "audio",
+            pronunciation_agent.config_fingerprint,
+            lambda inputs: pronunciation_agent.run(inputs["text"], "", voice_id=inputs["voice_id"]),
+            cacheable=self.audio_available,
+            on_replace=on_audio_replace
+        )
+        # Automatically selected voices are cached per ethnicity, so a VOICE_MAP
+        # change serves the old clip while the new voice is generated.
+        cache.register_stage(
+            "auto_audio",
+            lambda: pronunciation_agent.config_fingerprint(automatic_selection=True),
+            lambda inputs: pronunciation_agent.run(inputs["text"], inputs["ethnicity"]),
+            cacheable=self.audio_available,
+            on_replace=on_audio_replace
+        )
+
+    def audio_file_path(self, web_path: str) -> str:
+        """Maps an /static/audio/... URL from the pronunciation agent to its file on disk."""
+        return os.path.join(self.audio_dir, os.path.basename(web_path))
+
+    def audio_available(self, result: Dict[str, Any]) -> bool:
+        """Audio results are only usable while their clip is still on disk."""
+        return result.get("status") == "success" and os.path.exists(self.audio_file_path(result["audio_output"]))
+
+    def audio_results(self) -> list[Dict[str, Any]]:
+        """Returns every cached audio result, fresh or stale."""
+        return self.cache.values("audio") + self.cache.values("auto_audio")
+
+    def run_text_pipeline(self, name: str, allow_stale: bool = True) -> tuple[Dict[str, Any], Dict[str, Any], str]:
+        """
+        Runs the cached ethnicity and transliteration stages for a name.
+
+        With allow_stale=False, results from an outdated agent configuration are
+        recomputed instead of being served.
+
+        Returns:
+            The ethnicity result, the transliteration result and the text to pronounce.
+        """
+        # Step 1: Detect ethnicity
+        ethnicity_result = self.cache.get("ethnicity", name_key(name), {"name": name}, allow_stale)
+        detected_ethnicity = ethnicity_result.get("ethnicity", "Uncertain")
+
+        # Step 2: Transliterate name to native script
+        transliteration_result = self.cache.get(
+            "transliteration",
+            f"{name_key(name)}|{detected_ethnicity}",
+            {"name": name, "ethnicity": detected_ethnicity},
+            allow_stale
+        )
+
+        # Determine which name to use for pronunciation
+        if transliteration_result.get("transliteration_successful"):
+            name_to_pronounce = transliteration_result.get("native_script", name)
+        else:
+            name_to_pronounce = name # Fallback to original name
+
+        return ethnicity_result, transliteration_result, name_to_pronounce
+
+    def generate_pronunciation(self, text: str, ethnicity: str, voice_id: str | None = None, selection_method: str | None = None, allow_stale: bool = True) -> Dict[str, Any]:
+        """Returns a cached audio clip for the text, generating it on a miss."""
+        if not voice_id:
+            normalized_ethnicity = ethnicity.lower().strip()
+            return dict(self.cache.get(
+                "auto_audio",
+                f"{normalized_ethnicity}|{text}",
+                {"text": text, "ethnicity": normalized_ethnicity},
+                allow_stale
+            ))
+
+        result = dict(self.cache.get("audio", f"{voice_id}|{text}", {"text": text, "voice_id": voice_id}, allow_stale))
+        # The clip only depends on text and voice; how the voice was chosen is per request.
+        result["selection_method"] = selection_method or "manual"
+        return result
+
+    def generate_pronunciations_for_voices(self, text: str, voice_list: list[Dict[str, str]], voice_type: str) -> list[Dict[str, Any]]:
+        """Returns cached audio clips for the text from every voice in voice_list."""
+        results = []
+        for voice in voice_list:
+            result = self.generate_pronunciation(text, "", voice['voice_id'], f"manual_all_{voice_type}")
+            result['voice_name'] = voice['name']
+            results.append(result)
+        return results